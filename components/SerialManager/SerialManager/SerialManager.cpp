@@ -51,7 +51,8 @@ void SerialManager::try_receive()
       current_position = 0;
 
       const nlohmann::json result = this->commandManager->executeFromJson(std::string_view(reinterpret_cast<const char *>(this->data)));
-      const auto resultMessage = result.dump();
+      // terminate every response with a new line, so hosts can frame them line by line
+      const auto resultMessage = result.dump() + "\n";
       usb_serial_jtag_write_bytes_chunked(resultMessage.c_str(), resultMessage.length(), 1000 / 20);
     }
   }
@@ -98,6 +99,23 @@ void SerialManager::shutdown()
   }
 }
 
+// tud_cdc_write only queues as much as fits into the TX FIFO, so bigger responses
+// (like batched commands) have to be pushed out in pieces while the host drains them
+static void tud_cdc_write_chunked(const char *data, size_t len)
+{
+  while (len > 0 && tud_cdc_connected())
+  {
+    auto written = tud_cdc_write(data, len);
+    tud_cdc_write_flush();
+    data += written;
+    len -= written;
+    if (written == 0)
+    {
+      vTaskDelay(1);
+    }
+  }
+}
+
 // we can cancel this task once we're in cdc
 void HandleSerialManagerTask(void *pvParameters)
 {
@@ -128,9 +146,8 @@ void HandleCDCSerialManagerTask(void *pvParameters)
         {
           buffer[idx - 1] = '\0';
           const nlohmann::json result = commandManager->executeFromJson(std::string_view(reinterpret_cast<const char *>(buffer)));
-          const auto resultMessage = result.dump();
-          tud_cdc_write(resultMessage.c_str(), resultMessage.length());
-          tud_cdc_write_flush();
+          const auto resultMessage = result.dump() + "\n";
+          tud_cdc_write_chunked(resultMessage.c_str(), resultMessage.length());
           idx = 0;
         }
       }
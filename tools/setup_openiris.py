@@ -6,10 +6,12 @@
 
 
 import json
+import logging
 import time
 import argparse
 import sys
 import serial
+import struct
 import string
 from dataclasses import dataclass
 
@@ -79,13 +81,43 @@ class Menu(SubMenu):
         super().__init__(title, context, parent_menu)
 
 
+logger = logging.getLogger("openiris.setup")
+
+# shared across all reads, there's no point in building a new decoder for every response
+JSON_DECODER = json.JSONDecoder()
+
+# 64 byte packets, one per 1 ms full speed USB frame
+CDC_SINGLE_PACKET_RATE = 64 * 1000
+# CFG_TUD_CDC_TX_BUFSIZE, smaller transfers never get to fill the link
+CDC_TX_FIFO_SIZE = 256
+
+# macOS ioctl for the serial read latency, _IOW('T', 0, unsigned long)
+IOSSDATALAT = 0x80085400
+
+
+def _set_low_latency(connection: serial.Serial):
+    # USB serial drivers may hold received bytes back for a few milliseconds
+    # before handing them over, which dominates the round trip of our small
+    # json responses. Ask the driver to deliver them immediately where we can,
+    # and silently keep the defaults everywhere else.
+    try:
+        if sys.platform.startswith("linux"):
+            # sets ASYNC_LOW_LATENCY through TIOCGSERIAL / TIOCSSERIAL
+            connection.set_low_latency_mode(True)
+        elif sys.platform == "darwin":
+            import fcntl
+
+            fcntl.ioctl(connection.fileno(), IOSSDATALAT, struct.pack("L", 1))
+    except (AttributeError, NotImplementedError, OSError, ValueError):
+        pass
+
+
 class OpenIrisDevice:
-    def __init__(self, port: str, debug: bool, debug_commands: bool):
+    def __init__(self, port: str):
         self.port = port
-        self.debug = debug
-        self.debug_commands = debug_commands
         self.connection: serial.Serial | None = None
         self.connected = False
+        self.newline_terminated = False
 
     def __enter__(self):
         self.connected = self.__connect()
@@ -101,6 +133,7 @@ class OpenIrisDevice:
             self.connection = serial.Serial(
                 port=self.port, baudrate=115200, timeout=1, write_timeout=1
             )
+            _set_low_latency(self.connection)
             print(f"✅ Connected to the device on {self.port}")
             return True
         except Exception as e:
@@ -112,55 +145,133 @@ class OpenIrisDevice:
             self.connection.close()
             print(f"🔌 Disconnected from {self.port}")
 
-    def __check_if_response_is_complete(self, response) -> dict | None:
+    def __check_if_response_is_complete(self, response) -> tuple[dict, int] | None:
+        # raw_decode stops at the end of the first complete json document,
+        # so anything the device logs right after the response doesn't matter
         try:
-            return json.loads(response)
+            parsed_response, end = JSON_DECODER.raw_decode(response)
         except ValueError:
             return None
 
-    def __read_response(self, timeout: int | None = None) -> dict | None:
+        # newer firmware ends every response with a new line, once we've seen that
+        # we can wait for it instead of trying to decode on every closing bracket
+        if response[end : end + 1] == "\n":
+            self.newline_terminated = True
+        return parsed_response, end
+
+    def __is_response_to(self, response: dict, commands: list[str]) -> bool:
+        if "results" in response:
+            answered = [result.get("command") for result in response["results"]]
+            return answered == commands
+        # errors about a specific command name it, anything else (like a parse error)
+        # can't be told apart from a late answer to something we've sent before
+        return response.get("command") in commands
+
+    def __find_response(
+        self, response_buffer: bytearray, commands: list[str]
+    ) -> tuple[dict | None, bytearray, int]:
+        # a response to an earlier command that timed out can still show up late,
+        # skip anything that doesn't answer what we've sent and keep what's left,
+        # along with how many brackets are still open in it.
+        # surrogateescape keeps undecodable bytes, like a multibyte character cut off
+        # at the end of the buffer, so we can map the decoded text back to the bytes
+        response = response_buffer.decode("utf-8", errors="surrogateescape")
+        while checked_response := self.__check_if_response_is_complete(response):
+            parsed_response, end = checked_response
+            if self.__is_response_to(parsed_response, commands):
+                return parsed_response, response_buffer, 0
+
+            logger.debug("Dropping unrelated response: %s", parsed_response)
+            end_idx = len(response[:end].encode("utf-8", errors="surrogateescape"))
+            starting_idx = response_buffer.find(b"{", end_idx)
+            if starting_idx == -1:
+                return None, bytearray(), 0
+            response_buffer = response_buffer[starting_idx:]
+            response = response_buffer.decode("utf-8", errors="surrogateescape")
+
+        open_brackets = response_buffer.count(b"{") - response_buffer.count(b"}")
+        return None, response_buffer, open_brackets
+
+    def __read_response(
+        self, commands: list[str], timeout: int | None = None
+    ) -> tuple[dict | None, int]:
+        # returns the response along with how many raw bytes we've read to get it
         # we can try and retrieve the response now.
         # it should be more or less immediate, but some commands may take longer
         # so we gotta timeout
         timeout = timeout if timeout is not None else 15
-        start_time = time.time()
-        response_buffer = ""
-        while time.time() - start_time < timeout:
-            if self.connection.in_waiting:
-                packet = self.connection.read_all().decode("utf-8", errors="ignore")
-                if self.debug and packet.strip():
-                    print(f"Received: {packet}")
-                    print("-" * 10)
-                    print(f"Current buffer: {response_buffer}")
-                    print("-" * 10)
-
-                # we can't rely on new lines to detect if we're done
+        deadline = time.monotonic() + timeout
+        # keep the raw bytes and only decode them when the response may be complete,
+        # decoding every packet on its own could split multibyte characters
+        response_buffer = bytearray()
+        # brackets opened but not yet closed in the buffer, counted per packet
+        # so we don't have to rescan the whole buffer every time something arrives
+        open_brackets = 0
+        received_bytes = 0
+        # the port timeout bounds every single read, so we stay responsive to the
+        # deadline, and gets lowered once for the last stretch so we don't block
+        # a whole second past it. changing it reconfigures the port,
+        # so we don't keep chasing the shrinking remainder
+        read_timeout = self.connection.timeout
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                if remaining < read_timeout and self.connection.timeout == read_timeout:
+                    self.connection.timeout = remaining
+                # block until at least one byte shows up (or the port timeout passes)
+                # instead of polling in_waiting and sleeping between checks
+                packet = self.connection.read(self.connection.in_waiting or 1)
+                received_bytes += len(packet)
+                if not packet:
+                    # the device went quiet, if the bracket count got thrown off
+                    # (like by a "{" in an SSID) what we have may already be complete
+                    if response_buffer:
+                        parsed_response, response_buffer, open_brackets = (
+                            self.__find_response(response_buffer, commands)
+                        )
+                        if parsed_response:
+                            return parsed_response, received_bytes
+                    continue
+
+                # arguments only get formatted if debug output is enabled
+                logger.debug(
+                    "Received: %r\n----------\nCurrent buffer: %r\n----------",
+                    packet,
+                    response_buffer,
+                )
+
+                # we can't rely on new lines alone to detect if we're done,
+                # the device logs lines too
                 # nor can we assume that we're always gonna get valid json response
                 # but we can assume that if we're to get a valid response, it's gonna be json
                 # so we can start actually building the buffer only when
                 # some part of the packet starts with "{", and start building from there
-                # we can assume that no further data will be returned, so we can validate
-                # right after receiving the last packet
-                if (not response_buffer and "{" in packet) or response_buffer:
-                    # assume we just started building the buffer and we've received the first packet
-
-                    # alternative approach in case this doesn't work - we're always sending a valid json
-                    # so we can start building the buffer from the first packet and keep trying to find the
-                    # starting and ending brackets, extract that part and validate, if the message is complete, return
-                    if not response_buffer:
-                        starting_idx = packet.find("{")
-                        response_buffer = packet[starting_idx:]
-                    else:
-                        response_buffer += packet
-
-                    # and once we get something, we can validate if it's a valid json
-                    if parsed_response := self.__check_if_response_is_complete(
-                        response_buffer
-                    ):
-                        return parsed_response
-            else:
-                time.sleep(0.1)
-        return None
+                if not response_buffer:
+                    starting_idx = packet.find(b"{")
+                    if starting_idx == -1:
+                        continue
+                    packet = packet[starting_idx:]
+                response_buffer += packet
+                open_brackets += packet.count(b"{") - packet.count(b"}")
+
+                # a json object can only be complete once its terminating new line
+                # arrived, if the firmware sends one, or once all of its brackets
+                # got closed, so there's no point in decoding the buffer before that
+                if self.newline_terminated:
+                    if b"\n" not in packet:
+                        continue
+                elif open_brackets > 0:
+                    continue
+
+                parsed_response, response_buffer, open_brackets = self.__find_response(
+                    response_buffer, commands
+                )
+                if parsed_response:
+                    return parsed_response, received_bytes
+        finally:
+            if self.connection.timeout != read_timeout:
+                self.connection.timeout = read_timeout
+
+        return None, received_bytes
 
     def is_connected(self) -> bool:
         return self.connected
@@ -168,34 +279,95 @@ class OpenIrisDevice:
     def send_command(
         self, command: str, params: dict | None = None, timeout: int | None = None
     ) -> dict:
+        return self.send_commands([(command, params)], timeout)
+
+    def send_commands(
+        self, commands: list[tuple[str, dict | None]], timeout: int | None = None
+    ) -> dict:
+        # the device executes every command from a single write in order
+        # and answers with one response holding all of the results
+        response, _ = self.__exchange(commands, timeout)
+        return response
+
+    def __exchange(
+        self, commands: list[tuple[str, dict | None]], timeout: int | None = None
+    ) -> tuple[dict, int]:
+        # sends the commands, returns the response and how many bytes we've read for it
         if not self.connection or not self.connection.is_open:
-            return {"error": "Device Not Connected"}
+            return {"error": "Device Not Connected"}, 0
 
-        cmd_obj = {"commands": [{"command": command}]}
-        if params:
-            cmd_obj["commands"][0]["data"] = params
+        cmd_obj = {"commands": []}
+        for command, params in commands:
+            command_entry = {"command": command}
+            if params:
+                command_entry["data"] = params
+            cmd_obj["commands"].append(command_entry)
 
         # we're expecting the json string to end with a new line
         # to signify we've finished sending the command
-        cmd_str = json.dumps(cmd_obj) + "\n"
+        cmd_str = json.dumps(cmd_obj, separators=(",", ":")) + "\n"
         try:
             # clean it out first, just to be sure we're starting fresh
             self.connection.reset_input_buffer()
-            if self.debug or self.debug_commands:
-                print(f"Sending command: {cmd_str}")
+            logger.info("Sending command: %s", cmd_str)
             self.connection.write(cmd_str.encode())
-            response = self.__read_response(timeout)
+            response, received_bytes = self.__read_response(
+                [command for command, _ in commands], timeout
+            )
 
-            if self.debug:
-                print(f"Received response: {response}")
+            logger.debug("Received response: %s", response)
 
-            return response or {"error": "Command timeout"}
+            return response or {"error": "Command timeout"}, received_bytes
 
+        except serial.SerialTimeoutException:
+            # the device stopped taking data, drop the rest of this command,
+            # then end the part it already got with a new line, so that it discards it
+            # instead of gluing it in front of our next command
+            self.connection.reset_output_buffer()
+            try:
+                self.connection.write(b"\n")
+            except serial.SerialException:
+                pass
+            return {"error": "Device stalled, it's not accepting commands"}, 0
         except Exception as e:
-            return {"error": f"Communication error: {e}"}
+            return {"error": f"Communication error: {e}"}, 0
+
+    def benchmark_throughput(self, batch_size: int = 32) -> dict | None:
+        # a single batch of get_who_am_i makes the device send one big response,
+        # so we time a bulk transfer instead of a bunch of small round trips.
+        # it's read-only and carries nothing sensitive,
+        # unlike get_config with its passwords.
+        # 32 of them answer with well over 2 KB while keeping the command itself
+        # below the firmware's 1024 byte buffer
+        start_time = time.perf_counter_ns()
+        response, received_bytes = self.__exchange(
+            [("get_who_am_i", None)] * batch_size
+        )
+        elapsed_s = (time.perf_counter_ns() - start_time) / 1e9
+        if split_batched_response(response) is None:
+            return None
+
+        return {
+            "received_bytes": received_bytes,
+            "elapsed_ms": elapsed_s * 1000,
+            "bytes_per_second": received_bytes / elapsed_s,
+        }
 
 
-@dataclass
+# indexed by the auth_mode reported by the device
+AUTH_MODES = (
+    "Open",
+    "WEP",
+    "WPA PSK",
+    "WPA2 PSK",
+    "WPA WPA2 PSK",
+    "WPA2 Enterprise",
+    "WPA3 PSK",
+    "WPA2 WPA3 PSK",
+)
+
+
+@dataclass(slots=True)
 class WiFiNetwork:
     ssid: str
     channel: int
@@ -206,17 +378,9 @@ class WiFiNetwork:
     @property
     def security_type(self) -> str:
         """Convert auth_mode to human readable string"""
-        auth_modes = {
-            0: "Open",
-            1: "WEP",
-            2: "WPA PSK",
-            3: "WPA2 PSK",
-            4: "WPA WPA2 PSK",
-            5: "WPA2 Enterprise",
-            6: "WPA3 PSK",
-            7: "WPA2 WPA3 PSK",
-        }
-        return auth_modes.get(self.auth_mode, f"Unknown ({self.auth_mode})")
+        if 0 <= self.auth_mode < len(AUTH_MODES):
+            return AUTH_MODES[self.auth_mode]
+        return f"Unknown ({self.auth_mode})"
 
 
 class WiFiScanner:
@@ -264,12 +428,26 @@ class WiFiScanner:
         return self.networks
 
 
+def split_batched_response(response: dict) -> dict[str, dict] | None:
+    # turns the response to send_commands() into single command responses keyed by
+    # the command they answer, or None if the device rejected the whole batch,
+    # either with an error or with an error result instead of the results list
+    results = response.get("results")
+    if "error" in response or not results:
+        return None
+
+    return {result["command"]: {"results": [result]} for result in results}
+
+
 def has_command_failed(result) -> bool:
     return "error" in result or result["results"][0]["result"]["status"] != "success"
 
 
 def get_device_mode(device: OpenIrisDevice) -> dict:
-    command_result = device.send_command("get_device_mode")
+    return parse_device_mode(device.send_command("get_device_mode"))
+
+
+def parse_device_mode(command_result: dict) -> dict:
     if has_command_failed(command_result):
         return {"mode": "unknown"}
 
@@ -277,7 +455,10 @@ def get_device_mode(device: OpenIrisDevice) -> dict:
 
 
 def get_led_duty_cycle(device: OpenIrisDevice) -> dict:
-    command_result = device.send_command("get_led_duty_cycle")
+    return parse_led_duty_cycle(device.send_command("get_led_duty_cycle"))
+
+
+def parse_led_duty_cycle(command_result: dict) -> dict:
     if has_command_failed(command_result):
         print(f"❌ Failed to get LED duty cycle: {command_result['error']}")
         return {"duty_cycle": "unknown"}
@@ -295,7 +476,10 @@ def get_led_duty_cycle(device: OpenIrisDevice) -> dict:
 
 
 def get_mdns_name(device: OpenIrisDevice) -> dict:
-    response = device.send_command("get_mdns_name")
+    return parse_mdns_name(device.send_command("get_mdns_name"))
+
+
+def parse_mdns_name(response: dict) -> dict:
     if "error" in response:
         print(f"❌ Failed to get device name: {response['error']}")
         return {"name": "unknown"}
@@ -304,7 +488,10 @@ def get_mdns_name(device: OpenIrisDevice) -> dict:
 
 
 def get_serial_info(device: OpenIrisDevice) -> dict:
-    response = device.send_command("get_serial")
+    return parse_serial_info(device.send_command("get_serial"))
+
+
+def parse_serial_info(response: dict) -> dict:
     if has_command_failed(response):
         print(f"❌ Failed to get serial/MAC: {response['error']}")
         return {"serial": None, "mac": None}
@@ -315,8 +502,10 @@ def get_serial_info(device: OpenIrisDevice) -> dict:
     }
 
 def get_device_info(device: OpenIrisDevice) -> dict:
-    response = device.send_command("get_who_am_i")
+    return parse_device_info(device.send_command("get_who_am_i"))
 
+
+def parse_device_info(response: dict) -> dict:
     if has_command_failed(response):
         print(f"❌ Failed to get device info: {response['error']}")
         return {"who_am_i": None, "version": None}
@@ -325,7 +514,10 @@ def get_device_info(device: OpenIrisDevice) -> dict:
 
 
 def get_wifi_status(device: OpenIrisDevice) -> dict:
-    response = device.send_command("get_wifi_status")
+    return parse_wifi_status(device.send_command("get_wifi_status"))
+
+
+def parse_wifi_status(response: dict) -> dict:
     if has_command_failed(response):
         print(f"❌ Failed to get wifi status: {response['error']}")
         return {"wifi_status": {"status": "unknown"}}
@@ -334,7 +526,10 @@ def get_wifi_status(device: OpenIrisDevice) -> dict:
 
 
 def get_led_current(device: OpenIrisDevice) -> dict:
-    response = device.send_command("get_led_current")
+    return parse_led_current(device.send_command("get_led_current"))
+
+
+def parse_led_current(response: dict) -> dict:
     if has_command_failed(response):
         print(f"❌ Failed to get LED current: {response}")
         return {"led_current_ma": "unknown"}
@@ -445,19 +640,30 @@ def get_settings_summary(device: OpenIrisDevice, *args, **kwargs):
     print("🧩 Collecting device settings...\n")
 
     probes = [
-        ("Identity", get_serial_info),
-        ("AdvertisedName", get_mdns_name),
-        ("Info", get_device_info),
-        ("LED", get_led_duty_cycle),
-        ("Current", get_led_current),
-        ("Mode", get_device_mode),
-        ("WiFi", get_wifi_status),
+        ("Identity", "get_serial", parse_serial_info),
+        ("AdvertisedName", "get_mdns_name", parse_mdns_name),
+        ("Info", "get_who_am_i", parse_device_info),
+        ("LED", "get_led_duty_cycle", parse_led_duty_cycle),
+        ("Current", "get_led_current", parse_led_current),
+        ("Mode", "get_device_mode", parse_device_mode),
+        ("WiFi", "get_wifi_status", parse_wifi_status),
     ]
 
+    commands = [command for _, command, _ in probes]
+    responses = split_batched_response(
+        device.send_commands([(command, None) for command in commands])
+    )
+    if responses is None:
+        # the device rejects the whole batch if it doesn't know one of the commands,
+        # like older firmware might, so ask one by one to still get everything else
+        responses = {command: device.send_command(command) for command in commands}
+
     summary: dict[str, dict] = {}
 
-    for label, probe in probes:
-        summary[label] = probe(device)
+    for label, command, parse in probes:
+        summary[label] = parse(
+            responses.get(command, {"error": f"No response to {command}"})
+        )
 
     print(f"🔑 Serial: {summary['Identity']}")
     print(f"💡 LED PWM Duty: {summary['LED']['duty_cycle']}%")
@@ -487,6 +693,37 @@ def get_settings_summary(device: OpenIrisDevice, *args, **kwargs):
         configured = wifi.get("networks_configured", 0)
         print(f"📶 WiFi: {status}  |  IP: {ip}  |  Networks configured: {configured}")
 
+
+def measure_throughput(device: OpenIrisDevice, *args, **kwargs):
+    print("📈 Measuring serial throughput...")
+    result = device.benchmark_throughput()
+    if not result:
+        print("❌ Failed to measure throughput")
+        return
+
+    print(
+        f"📦 Received {result['received_bytes']} bytes in {result['elapsed_ms']:.1f} ms"
+    )
+    print(f"🚀 Throughput: {result['bytes_per_second'] / 1000:.1f} KB/s")
+
+    # in UVC mode commands go through the TinyUSB CDC interface, a 64 byte endpoint
+    # moving one packet per 1 ms full speed frame tops out right around 64 KB/s.
+    # that only tells us something if the response was big enough to keep the link busy
+    if (
+        result["received_bytes"] >= 8 * CDC_TX_FIFO_SIZE
+        and result["bytes_per_second"] <= CDC_SINGLE_PACKET_RATE
+        and get_device_mode(device)["mode"] == "uvc"
+    ):
+        print(
+            "⚠️  This is about what a single 64 byte CDC packet per USB frame can move, "
+            "the link might be limited by the CDC buffers"
+        )
+        print(
+            "💡 Consider raising CFG_TUD_CDC_EP_BUFSIZE, CFG_TUD_CDC_RX_BUFSIZE and "
+            "CFG_TUD_CDC_TX_BUFSIZE in components/usb_device_uvc/tusb/tusb_config.h"
+        )
+
+
 def restart_device_command(device: OpenIrisDevice, *args, **kwargs):
     print("🔄 Restarting device...")
     response = device.send_command("restart_device")
@@ -682,13 +919,16 @@ def handle_menu(menu_context: dict | None = None) -> str:
     menu.add_action("🔄 Switch device mode (WiFi/UVC/Auto)", switch_device_mode_command)
     menu.add_action("💡 Update PWM Duty Cycle", set_led_duty_cycle)
     menu.add_action("🧩 Get settings summary", get_settings_summary)
+    menu.add_action("📈 Measure serial throughput", measure_throughput)
     menu.add_action("🔪 Restart device", restart_device_command)
     menu.show()
 
 
 def valid_port(port: str):
-    if not port.startswith("COM"):
-        raise argparse.ArgumentTypeError("Invalid port name. We only support COM ports")
+    if not port.startswith(("COM", "/dev/")):
+        raise argparse.ArgumentTypeError(
+            "Invalid port name. We only support COM ports and /dev/ devices"
+        )
     return port
 
 
@@ -697,7 +937,7 @@ def main():
     parser.add_argument(
         "--port",
         type=valid_port,
-        help="Serial port to connect to [COM4, COM3, etc]",
+        help="Serial port to connect to [COM4, COM3, /dev/ttyACM0, etc]",
         required=True,
     )
     parser.add_argument(
@@ -712,10 +952,19 @@ def main():
     )
     args = parser.parse_args()
 
+    # --debug shows everything, --show-commands only the sent commands
+    if args.debug:
+        log_level = logging.DEBUG
+    elif args.show_commands:
+        log_level = logging.INFO
+    else:
+        log_level = logging.WARNING
+    logging.basicConfig(level=log_level, format="%(message)s", stream=sys.stdout)
+
     print("🔧 OpenIris Setup Tool")
     print("=" * 50)
 
-    with OpenIrisDevice(args.port, args.debug, args.show_commands) as device:
+    with OpenIrisDevice(args.port) as device:
         if not device.is_connected():
             return 1
 